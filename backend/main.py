@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
@@ -14,6 +15,7 @@ import uvicorn
 from datetime import datetime
 import logging
 import json
+import asyncio
 import signal
 import sys
 from backend.train import load_model  # Use absolute import
@@ -77,12 +79,36 @@ class BatchPredictionResponse(BaseModel):
     failed_images: List[str]
     total_processing_time: float
 
+class PatientPredictionResponse(BaseModel):
+    patient_id: str
+    left_eye: Optional[PredictionResponse]
+    right_eye: Optional[PredictionResponse]
+    # None when no eye could be graded
+    referable_dr: Optional[bool]
+    # False when the decision is based on fewer than two eyes
+    complete: bool
+    failed_images: List[str]
+
+class BatchPatientPredictionResponse(BaseModel):
+    patients: List[PatientPredictionResponse]
+    failed_images: List[str]
+    total_processing_time: float
+
 class ModelInfo(BaseModel):
     model_loaded: bool
     input_shape: tuple
     last_training_date: Optional[str]
     total_parameters: int
 
+def parse_eye_filename(filename: str):
+    """Split a dataset filename like '10_left.jpeg' into (patient_id, eye)"""
+    stem = Path(filename or "").stem
+    patient_id, _, eye = stem.rpartition('_')
+    eye = eye.lower()
+    if not patient_id or eye not in ("left", "right"):
+        raise ValueError(f"Cannot determine patient and eye from filename: {filename}")
+    return patient_id, eye
+
 # ML Model setup
 class DRModel:
     def __init__(self):
@@ -95,6 +121,10 @@ class DRModel:
             "Proliferative DR"
         ]
         self.input_shape = (224, 224)
+        # Moderate DR or worse is considered referable
+        self.referable_threshold = 2
+        # Upper bound on images held in memory and scored per forward pass
+        self.max_batch_size = 32
         self.model_path = Path(__file__).resolve().parent / 'models' / 'dr_classification_model.h5'
         self.load_model()
 
@@ -136,9 +166,29 @@ class DRModel:
             return img_array
 
         except Exception as e:
-            logger.error(f"Preprocessing error: {str(e)}")
             raise ValueError(f"Error preprocessing image: {str(e)}")
 
+    def format_prediction(self, prediction, processing_time):
+        """Convert raw class probabilities into a prediction response"""
+        # Get the predicted class and confidence
+        predicted_class = int(np.argmax(prediction))
+        confidence = float(prediction[predicted_class])
+
+        # Calculate scores for all classes
+        severity_scores = {
+            label: float(score) * 100
+            for label, score in zip(self.severity_labels, prediction)
+        }
+
+        return {
+            'severity': self.severity_labels[predicted_class],
+            'confidence': confidence * 100,  # Convert to percentage
+            'severity_scores': severity_scores,
+            'processing_time': processing_time,
+            # Not part of PredictionResponse, used for patient-level decisions
+            'referable': predicted_class >= self.referable_threshold
+        }
+
     def predict(self, preprocessed_image):
         """Make prediction using the model"""
         try:
@@ -153,29 +203,42 @@ class DRModel:
                 # Real model prediction
                 prediction = self.model.predict(preprocessed_image, verbose=0)[0]
 
-            # Get the predicted class and confidence
-            predicted_class = np.argmax(prediction)
-            confidence = float(prediction[predicted_class])
-
-            # Calculate scores for all classes
-            severity_scores = {
-                label: float(score) * 100
-                for label, score in zip(self.severity_labels, prediction)
-            }
-
             processing_time = (datetime.now() - start_time).total_seconds()
 
-            return {
-                'severity': self.severity_labels[predicted_class],
-                'confidence': confidence * 100,  # Convert to percentage
-                'severity_scores': severity_scores,
-                'processing_time': processing_time
-            }
+            return self.format_prediction(prediction, processing_time)
 
         except Exception as e:
             logger.error(f"Prediction error: {str(e)}")
             raise ValueError(f"Error making prediction: {str(e)}")
 
+    def predict_batch(self, preprocessed_images):
+        """Make predictions for several preprocessed images, one forward pass per chunk"""
+        try:
+            results = []
+            for i in range(0, len(preprocessed_images), self.max_batch_size):
+                chunk = preprocessed_images[i:i + self.max_batch_size]
+                start_time = datetime.now()
+
+                if self.model == "mock":
+                    # Generate mock predictions
+                    predictions = np.random.random((len(chunk), len(self.severity_labels)))
+                    predictions = predictions / predictions.sum(axis=1, keepdims=True)
+                else:
+                    # Each preprocessed image already carries a batch dimension of 1
+                    batch = np.concatenate(chunk, axis=0)
+                    predictions = self.model.predict(batch, verbose=0)
+
+                # Time of the forward pass that scored this image
+                processing_time = (datetime.now() - start_time).total_seconds()
+
+                results.extend(self.format_prediction(prediction, processing_time) for prediction in predictions)
+
+            return results
+
+        except Exception as e:
+            logger.error(f"Batch prediction error: {str(e)}")
+            raise ValueError(f"Error making batch prediction: {str(e)}")
+
 # Initialize model
 dr_model = DRModel()
 
@@ -189,6 +252,8 @@ async def root():
         "endpoints": {
             "predict": "/predict - Analyze single image",
             "batch_predict": "/batch_predict - Analyze multiple images",
+            "predict_patient": "/predict_patient - Analyze left and right eye of one patient",
+            "batch_predict_patient": "/batch_predict_patient - Analyze images grouped by patient",
             "health": "/health - Check API health",
             "docs": "/docs - API documentation"
         }
@@ -286,6 +351,177 @@ async def batch_predict(files: List[UploadFile] = File(...)):
         logger.error(f"Error in batch prediction: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def score_patients(patient_files):
+    """
+    Score images grouped by patient, one forward pass per chunk of images
+
+    Parameters:
+    - patient_files: Mapping of patient id to {eye: UploadFile}
+
+    Returns:
+    - List of per-patient results and any failed images
+    """
+    start_time = datetime.now()
+    entries = [
+        (patient_id, eye, file)
+        for patient_id, eyes in patient_files.items()
+        for eye, file in eyes.items()
+    ]
+
+    scored_entries = []
+    results = []
+    failed_by_patient = {patient_id: [] for patient_id in patient_files}
+
+    # Work through the upload in chunks so memory stays bounded by the batch size
+    for i in range(0, len(entries), dr_model.max_batch_size):
+        chunk = entries[i:i + dr_model.max_batch_size]
+
+        # Read and preprocess every eye in the chunk concurrently
+        contents = await asyncio.gather(*(file.read() for _, _, file in chunk))
+        preprocessed = await asyncio.gather(
+            *(run_in_threadpool(dr_model.preprocess_image, data) for data in contents),
+            return_exceptions=True
+        )
+
+        scored_images = []
+        for (patient_id, eye, file), image in zip(chunk, preprocessed):
+            if isinstance(image, Exception):
+                logger.error(f"Error processing {file.filename}: {str(image)}")
+                failed_by_patient[patient_id].append(file.filename)
+            else:
+                scored_entries.append((patient_id, eye))
+                scored_images.append(image)
+
+        results.extend(await run_in_threadpool(dr_model.predict_batch, scored_images))
+
+    eye_results = {patient_id: {} for patient_id in patient_files}
+    for (patient_id, eye), result in zip(scored_entries, results):
+        eye_results[patient_id][eye] = result
+
+    total_time = (datetime.now() - start_time).total_seconds()
+    patients = []
+    for patient_id in patient_files:
+        eyes = eye_results[patient_id]
+        patients.append(PatientPredictionResponse(
+            patient_id=patient_id,
+            left_eye=eyes.get("left"),
+            right_eye=eyes.get("right"),
+            referable_dr=any(result['referable'] for result in eyes.values()) if eyes else None,
+            complete=len(eyes) == 2,
+            failed_images=failed_by_patient[patient_id]
+        ))
+
+    failed_images = [name for names in failed_by_patient.values() for name in names]
+    return patients, failed_images, total_time
+
+@app.post("/predict_patient", tags=["Prediction"], response_model=PatientPredictionResponse)
+async def predict_patient(
+    left_eye: UploadFile = File(...),
+    right_eye: UploadFile = File(...),
+    patient_id: Optional[str] = Form(None)
+):
+    """
+    Make predictions for both eyes of a single patient
+
+    Parameters:
+    - left_eye: Left eye retinal image
+    - right_eye: Right eye retinal image
+    - patient_id: Optional patient identifier, taken from the filenames if omitted
+      (must match the filenames when they follow the '<patient_id>_<eye>' pattern)
+
+    Returns:
+    - Per-eye predictions and a patient-level referable DR decision
+    """
+    try:
+        if dr_model.model is None:
+            raise HTTPException(status_code=503, detail="Model not loaded")
+
+        # Make sure both uploads belong to the same patient and the right eye field
+        filename_ids = set()
+        for field, file in (("left", left_eye), ("right", right_eye)):
+            try:
+                file_patient_id, eye = parse_eye_filename(file.filename)
+            except ValueError:
+                continue
+            if eye != field:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"{file.filename} is a {eye} eye image but was uploaded as {field}_eye"
+                )
+            filename_ids.add(file_patient_id)
+
+        # A blank patient_id counts as missing
+        if patient_id and patient_id.strip():
+            filename_ids.add(patient_id.strip())
+        if len(filename_ids) > 1:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Images belong to different patients: {sorted(filename_ids)}"
+            )
+        if not filename_ids:
+            raise HTTPException(
+                status_code=400,
+                detail="patient_id is required when the filenames do not identify the patient"
+            )
+        patient_id = filename_ids.pop()
+
+        patients, failed_images, _ = await score_patients(
+            {patient_id: {"left": left_eye, "right": right_eye}}
+        )
+        if len(failed_images) == 2:
+            raise HTTPException(status_code=400, detail=f"Could not process images: {failed_images}")
+
+        return patients[0]
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in patient prediction: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/batch_predict_patient", tags=["Prediction"], response_model=BatchPatientPredictionResponse)
+async def batch_predict_patient(files: List[UploadFile] = File(...)):
+    """
+    Make predictions for multiple patients, grouping images by filename
+
+    Parameters:
+    - files: List of image files named like '<patient_id>_left.jpeg' / '<patient_id>_right.jpeg'
+
+    Returns:
+    - Per-patient predictions and any failed images
+    """
+    try:
+        if dr_model.model is None:
+            raise HTTPException(status_code=503, detail="Model not loaded")
+
+        patient_files = {}
+        unmatched_images = []
+        for file in files:
+            try:
+                patient_id, eye = parse_eye_filename(file.filename)
+            except ValueError as e:
+                logger.error(str(e))
+                unmatched_images.append(file.filename)
+                continue
+
+            if eye in patient_files.setdefault(patient_id, {}):
+                logger.error(f"Duplicate {eye} eye image for patient {patient_id}: {file.filename}")
+                unmatched_images.append(file.filename)
+                continue
+            patient_files[patient_id][eye] = file
+
+        patients, failed_images, total_time = await score_patients(patient_files)
+
+        return BatchPatientPredictionResponse(
+            patients=patients,
+            failed_images=unmatched_images + failed_images,
+            total_processing_time=total_time
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in batch patient prediction: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/train", tags=["Model"])
 async def train(data_dir: str):
     try:
@@ -10,7 +10,8 @@ import albumentations as A
 from tqdm import tqdm
 import argparse
 from backend.utils import DRDataGenerator  # Import from utils.py
-from backend.train import create_model, train_model  # Use absolute import
+from backend.models import create_dr_model as create_model  # Use absolute import
+from backend.train import train_model  # Use absolute import
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 
 class DRDataGenerator:
@@ -0,0 +1,176 @@
+import io
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from backend.main import app, dr_model, parse_eye_filename
+
+client = TestClient(app)
+
+
+def make_image_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), color=(120, 40, 20)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+VALID_IMAGE = make_image_bytes()
+INVALID_IMAGE = b"not an image"
+
+
+class FakeModel:
+    """Predicts the class encoded in each image's pixel value"""
+
+    def __init__(self, num_classes):
+        self.num_classes = num_classes
+        self.calls = 0
+
+    def predict(self, batch, verbose=0):
+        self.calls += 1
+        classes = batch[:, 0, 0, 0].astype(int)
+        return np.eye(self.num_classes)[classes]
+
+
+@pytest.fixture(autouse=True)
+def mock_model(monkeypatch):
+    monkeypatch.setattr(dr_model, "model", "mock")
+
+
+@pytest.mark.parametrize("filename, expected", [
+    ("10_left.jpeg", ("10", "left")),
+    ("a_b_RIGHT.png", ("a_b", "right")),
+])
+def test_parse_eye_filename(filename, expected):
+    assert parse_eye_filename(filename) == expected
+
+
+@pytest.mark.parametrize("filename", ["foo.jpeg", None])
+def test_parse_eye_filename_invalid(filename):
+    with pytest.raises(ValueError):
+        parse_eye_filename(filename)
+
+
+def test_predict_batch_returns_one_result_per_input_in_order(monkeypatch):
+    fake_model = FakeModel(len(dr_model.severity_labels))
+    monkeypatch.setattr(dr_model, "model", fake_model)
+    monkeypatch.setattr(dr_model, "max_batch_size", 2)
+
+    levels = [3, 0, 4, 1, 2]
+    images = [np.full((1, 224, 224, 3), level, dtype=np.float32) for level in levels]
+    results = dr_model.predict_batch(images)
+
+    assert [result['severity'] for result in results] == [dr_model.severity_labels[level] for level in levels]
+    assert [result['referable'] for result in results] == [level >= dr_model.referable_threshold for level in levels]
+    assert fake_model.calls == 3
+
+
+def test_predict_batch_empty():
+    assert dr_model.predict_batch([]) == []
+
+
+def test_batch_predict_patient_groups_by_patient():
+    files = [
+        ("files", ("10_left.jpeg", VALID_IMAGE, "image/jpeg")),
+        ("files", ("13_right.jpeg", VALID_IMAGE, "image/jpeg")),
+        ("files", ("10_right.jpeg", VALID_IMAGE, "image/jpeg")),
+        ("files", ("10_left.png", VALID_IMAGE, "image/png")),
+        ("files", ("foo.jpeg", VALID_IMAGE, "image/jpeg")),
+    ]
+    response = client.post("/batch_predict_patient", files=files)
+
+    assert response.status_code == 200
+    body = response.json()
+    patients = {patient["patient_id"]: patient for patient in body["patients"]}
+    assert set(patients) == {"10", "13"}
+    assert patients["10"]["left_eye"] is not None
+    assert patients["10"]["right_eye"] is not None
+    assert patients["10"]["complete"] is True
+    assert patients["13"]["left_eye"] is None
+    assert patients["13"]["complete"] is False
+    assert sorted(body["failed_images"]) == ["10_left.png", "foo.jpeg"]
+
+
+def test_batch_predict_patient_one_eye_failed():
+    files = [
+        ("files", ("10_left.jpeg", VALID_IMAGE, "image/jpeg")),
+        ("files", ("10_right.jpeg", INVALID_IMAGE, "image/jpeg")),
+    ]
+    response = client.post("/batch_predict_patient", files=files)
+
+    assert response.status_code == 200
+    patient = response.json()["patients"][0]
+    assert patient["left_eye"] is not None
+    assert patient["right_eye"] is None
+    assert patient["referable_dr"] is not None
+    assert patient["complete"] is False
+    assert patient["failed_images"] == ["10_right.jpeg"]
+
+
+def test_batch_predict_patient_both_eyes_failed():
+    files = [
+        ("files", ("10_left.jpeg", INVALID_IMAGE, "image/jpeg")),
+        ("files", ("10_right.jpeg", INVALID_IMAGE, "image/jpeg")),
+    ]
+    response = client.post("/batch_predict_patient", files=files)
+
+    assert response.status_code == 200
+    body = response.json()
+    patient = body["patients"][0]
+    assert patient["referable_dr"] is None
+    assert patient["complete"] is False
+    assert sorted(body["failed_images"]) == ["10_left.jpeg", "10_right.jpeg"]
+
+
+def test_predict_patient():
+    files = {
+        "left_eye": ("10_left.jpeg", VALID_IMAGE, "image/jpeg"),
+        "right_eye": ("10_right.jpeg", VALID_IMAGE, "image/jpeg"),
+    }
+    response = client.post("/predict_patient", files=files)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["patient_id"] == "10"
+    assert body["complete"] is True
+    assert isinstance(body["referable_dr"], bool)
+
+
+def test_predict_patient_both_eyes_failed():
+    files = {
+        "left_eye": ("10_left.jpeg", INVALID_IMAGE, "image/jpeg"),
+        "right_eye": ("10_right.jpeg", INVALID_IMAGE, "image/jpeg"),
+    }
+    response = client.post("/predict_patient", files=files)
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("left_name, right_name, data", [
+    ("10_left.jpeg", "13_right.jpeg", {}),
+    ("10_right.jpeg", "10_left.jpeg", {}),
+    ("10_left.jpeg", "10_right.jpeg", {"patient_id": "13"}),
+    ("left.jpeg", "right.jpeg", {}),
+    ("a.png", "b.png", {"patient_id": ""}),
+    ("a.png", "b.png", {"patient_id": "   "}),
+])
+def test_predict_patient_rejects_mismatched_uploads(left_name, right_name, data):
+    files = {
+        "left_eye": (left_name, VALID_IMAGE, "image/jpeg"),
+        "right_eye": (right_name, VALID_IMAGE, "image/jpeg"),
+    }
+    response = client.post("/predict_patient", files=files, data=data)
+
+    assert response.status_code == 400
+
+
+def test_predict_patient_blank_patient_id_uses_filenames():
+    files = {
+        "left_eye": ("10_left.jpeg", VALID_IMAGE, "image/jpeg"),
+        "right_eye": ("10_right.jpeg", VALID_IMAGE, "image/jpeg"),
+    }
+    response = client.post("/predict_patient", files=files, data={"patient_id": " "})
+
+    assert response.status_code == 200
+    assert response.json()["patient_id"] == "10"